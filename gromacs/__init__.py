@@ -257,8 +257,8 @@ config.set_gmxrc_environment(config.cfg.getpath("Gromacs", "GMXRC"))
 
 # Add gromacs command **instances** to the top level.
 # These serve as the equivalence of running commands in the shell.
-# (Note that each gromacs command is actually run when the instance is
-# created in order to gather the documentation string.)
+# (Note that the documentation string of each command is only gathered
+# by running the gromacs command when it is first accessed.)
 from . import tools
 
 # Ignore warnings from a few programs that do not produce
@@ -267,24 +267,25 @@ from . import tools
 warnings.simplefilter("ignore", GromacsFailureWarning)
 _have_g_commands = []
 _missing_g_commands = []
-for clsname, cls in tools.registry.items():
+_g_commands = {}
+# (iterating in sorted order keeps the lists of command names sorted)
+for clsname, cls in sorted(tools.registry.items()):
     name = clsname[0].lower() + clsname[1:]    # instances should start with lower case
     try:
-        globals()[name] = cls()                # add instance of command for immediate use
+        _g_commands[name] = cls()              # instance of command for immediate use
         _have_g_commands.append(name)
     except:
         _missing_g_commands.append(name)
+globals().update(_g_commands)                  # add all instances at once
 warnings.simplefilter("always", GromacsFailureWarning)
 warnings.simplefilter("always", GromacsImportWarning)
 
-_have_g_commands.sort()
-_missing_g_commands.sort()
 if len(_missing_g_commands) > 0:
     warnings.warn("Some Gromacs commands were NOT found; "
                   "maybe source GMXRC first? The following are missing:\n%r\n" % _missing_g_commands,
                   category=GromacsImportWarning)
 
-del name, cls, clsname
+del name, cls, clsname, _g_commands
 
 # get ALL active command instances with 'from gromacs import *'
 __all__.extend(_have_g_commands)
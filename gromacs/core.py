@@ -97,17 +97,54 @@ Classes
 
 .. autoclass:: PopenWithInput
    :members:
+
+
+Running commands concurrently
+-----------------------------
+
+Independent commands (for instance, the same analysis for many windows or
+trajectories) can be run at the same time with :func:`gather_commands`::
+
+  from functools import partial
+  results = gather_commands([partial(gromacs.g_energy, f="md{0}.edr".format(i),
+                                     o="energy{0}.xvg".format(i), input=["Potential"])
+                             for i in range(100)], max_parallel=8)
+
+.. autofunction:: gather_commands
+
+
+Documentation cache
+-------------------
+
+The documentation of a Gromacs tool is obtained by running the tool with the
+``-h`` flag the first time its doc string is requested. The result is kept in
+the file :data:`DOC_CACHE_FILENAME` (keyed on the tool name and the path and
+modification time of the executable) so that later sessions do not have to
+launch the tool again. The cache is written when the interpreter exits; it is
+safe to delete the file at any time.
+
+.. autodata:: DOC_CACHE_FILENAME
 """
 from __future__ import absolute_import, with_statement
 
 __docformat__ = "restructuredtext en"
 
+import os
 import sys
 import re
 import subprocess
 from subprocess import STDOUT, PIPE
 import warnings
 import errno
+import select
+import atexit
+import tempfile
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+import six
+from six.moves import cPickle as pickle
+from six.moves import intern
 
 import logging
 logger = logging.getLogger('gromacs.core')
@@ -115,6 +152,83 @@ logger = logging.getLogger('gromacs.core')
 
 from .exceptions import GromacsError, GromacsFailureWarning
 from . import environment
+from . import config
+from . import utilities
+
+#: File that holds the cached documentation of the Gromacs tools.
+DOC_CACHE_FILENAME = os.path.join(config.configdir, "docs.pickle")
+
+# dict of doc strings, keyed by GromacsCommand._doc_cache_key(); loaded from
+# DOC_CACHE_FILENAME on first use and written back at exit if it changed
+_DOC_CACHE = None
+_DOC_CACHE_MODIFIED = False
+
+# full paths of executables, keyed by (name, PATH); see _find_executable()
+_EXECUTABLES = {}
+
+def _find_executable(name):
+    """Return the full path of executable *name* on :envvar:`PATH` or ``None``.
+
+    Successful look-ups are cached for the current :envvar:`PATH` so that
+    commands that are run many times only search :envvar:`PATH` once. Names
+    with a directory part are not looked up (``None`` is returned) because
+    relative paths depend on the current working directory.
+    """
+    if os.path.dirname(name):
+        return None
+    searchpath = os.environ.get('PATH')
+    try:
+        return _EXECUTABLES[name, searchpath]
+    except KeyError:
+        pass
+    if searchpath is None:
+        return None
+    path = utilities.which(name)
+    if path is not None:
+        _EXECUTABLES[name, searchpath] = path
+    return path
+
+def _retry_on_eintr(func, *args):
+    """Call *func* with *args*, repeating the call when a signal interrupts it."""
+    while True:
+        try:
+            return func(*args)
+        except (select.error, OSError) as err:
+            # Python 2: select.error is not an OSError and has no errno attribute
+            if not err.args or err.args[0] != errno.EINTR:
+                raise
+
+def _get_doc_cache():
+    """Return the documentation cache, loading it from disk on first use."""
+    global _DOC_CACHE
+    if _DOC_CACHE is None:
+        try:
+            with open(DOC_CACHE_FILENAME, 'rb') as cache:
+                _DOC_CACHE = pickle.load(cache)
+        except Exception:
+            # missing, unreadable or corrupted cache: start from scratch
+            _DOC_CACHE = {}
+        atexit.register(_save_doc_cache)
+    return _DOC_CACHE
+
+def _save_doc_cache():
+    """Atomically write the documentation cache to :data:`DOC_CACHE_FILENAME`."""
+    if not _DOC_CACHE_MODIFIED:
+        return
+    dirname = os.path.dirname(DOC_CACHE_FILENAME)
+    try:
+        utilities.mkdir_p(dirname)
+        fd, tmpname = tempfile.mkstemp(dir=dirname, prefix=".docs.", suffix=".pickle")
+        try:
+            with os.fdopen(fd, 'wb') as cache:
+                pickle.dump(_DOC_CACHE, cache, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmpname, DOC_CACHE_FILENAME)   # atomic on POSIX
+        except:
+            utilities.unlink_f(tmpname)
+            raise
+    except (IOError, OSError) as err:
+        logger.debug("Could not write documentation cache %r: %s", DOC_CACHE_FILENAME, err)
+
 
 class Command(object):
     """Wrap simple script or command."""
@@ -123,6 +237,10 @@ class Command(object):
     #: cannot be found by searching :envvar:`PATH`.
     command_name = None
 
+    # fixed attributes are slots; subclasses without __slots__ (such as the
+    # generated tool classes) still have a __dict__ for everything else
+    __slots__ = ('args', 'kwargs', '__weakref__')
+
     def __init__(self, *args, **kwargs):
         """Set up the command class.
 
@@ -154,6 +272,25 @@ class Command(object):
         self.args = args
         self.kwargs = kwargs
 
+    def __getstate__(self):
+        """Return slots and :attr:`__dict__` as state (needed for pickling with __slots__)."""
+        state = dict(getattr(self, '__dict__', {}))
+        for cls in type(self).__mro__:
+            for name in cls.__dict__.get('__slots__', ()):
+                if name == '__weakref__':
+                    continue
+                if name.startswith('__') and not name.endswith('__'):
+                    name = '_' + cls.__name__.lstrip('_') + name   # mangled slot name
+                try:
+                    state[name] = getattr(self, name)
+                except AttributeError:
+                    pass                        # unset slot
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def run(self, *args, **kwargs):
         """Run the command; args/kwargs are added or replace the ones given to the constructor."""
         _args, _kwargs = self._combine_arglist(args, kwargs)
@@ -250,25 +387,31 @@ class Command(object):
         input = kwargs.pop('input', None)
 
         use_shell = kwargs.pop('use_shell', False)
+        bufsize = kwargs.pop('bufsize', -1)     # default: fully buffered pipes
         if input:
             stdin = PIPE
-            if isinstance(input, basestring) and not input.endswith('\n'):
-                # make sure that input is a simple string with \n line endings
-                input += '\n'
+            if isinstance(input, basestring):
+                if not input.endswith('\n'):
+                    # make sure that input is a simple string with \n line endings
+                    input += '\n'
             else:
                 try:
-                    # make sure that input is a simple string with \n line endings
+                    # make sure that input is a simple string with \n line endings;
+                    # the empty last element adds the trailing newline in the same join
                     # XXX: this is probably not unicode safe because of the use of str()
-                    input = '\n'.join(map(str, input)) + '\n'
+                    input = '\n'.join([str(line) for line in input] + [''])
                 except TypeError:
                     # so maybe we are a file or something ... and hope for the best
                     pass
 
         cmd = self._commandline(*args, **kwargs)   # lots of magic happening here
                                                    # (cannot move out of method because filtering of stdin etc)
+        # with the full path of the executable Popen need not search PATH
+        executable = None if use_shell else _find_executable(cmd[0])
         try:
             p = PopenWithInput(cmd, stdin=stdin, stderr=stderr, stdout=stdout,
-                               universal_newlines=True, input=input, shell=use_shell)
+                               universal_newlines=True, input=input, shell=use_shell,
+                               bufsize=bufsize, executable=executable)
         except OSError as err:
             logger.error(" ".join(cmd))            # log command line
             if err.errno == errno.ENOENT:
@@ -347,6 +490,10 @@ class Command(object):
                      returns the output as a string in the stderr return parameter
              ``None`` or ``True``
                      keeps it on stderr (and presumably on screen)
+          *bufsize*
+             buffering of the pipes, as in :class:`subprocess.Popen`; the
+             default -1 uses fully buffered pipes (1 selects line
+             buffering) [-1]
 
         Depending on the value of the GromacsWrapper flag
         :data:`gromacs.environment.flags```['capture_output']`` the above
@@ -381,6 +528,37 @@ class Command(object):
         return self.run(*args, **kwargs)
 
 
+def _raise_failure(rc, msg):
+    raise GromacsError(rc, msg)
+
+def _warn_failure(rc, msg):
+    warnings.warn(msg + '\nError code: {0!r}\n'.format(rc), category=GromacsFailureWarning)
+
+def _ignore_failure(rc, msg):
+    pass
+
+# how a failed command is handled for each GromacsCommand.failuremode
+_FAILURE_HANDLERS = {'raise': _raise_failure,
+                     'warn': _warn_failure,
+                     None: _ignore_failure}
+
+
+class _LazyDoc(object):
+    """Descriptor for the doc string of a :class:`GromacsCommand` class.
+
+    Accessed on the class it returns the generic *doc*; accessed on an
+    instance it returns the documentation of the Gromacs tool, which is only
+    extracted (by running the tool) on first access.
+    """
+    def __init__(self, doc=None):
+        self.doc = doc
+
+    def __get__(self, obj, owner):
+        if obj is None:
+            return self.doc
+        return obj.gmxdoc
+
+
 class GromacsCommand(Command):
     """Base class for wrapping a Gromacs tool.
 
@@ -398,7 +576,6 @@ class GromacsCommand(Command):
 
     command_name = None
     driver = None
-    doc_pattern = """.*?(?P<DOCS>DESCRIPTION.*)"""
     gmxfatal_pattern = """----+\n                   # ---- decorator line
             \s*Program\s+(?P<program_name>\w+),     #  Program name,
               \s+VERSION\s+(?P<version>[\w.]+)\s*\n #    VERSION 4.0.5
@@ -415,6 +592,11 @@ class GromacsCommand(Command):
     #: Available failure modes.
     failuremodes = ('raise', 'warn', None)
 
+    __slots__ = ('__failuremode', '_on_failure', 'gmxargs', '_doc_cache')
+
+    #: Cache of keyword name --> (gromacs flag, negated gromacs flag).
+    _flag_cache = {}
+
     def __init__(self, *args, **kwargs):
         """Set up the command with gromacs flags as keyword arguments.
 
@@ -441,7 +623,7 @@ class GromacsCommand(Command):
            Any Gromacs options that take parameters are handled as keyword
            arguments. If an option takes multiple arguments (such as the
            multi-file input ``-f file1 file2 ...``) then the list of files must be
-           supplied as a python list.
+           supplied as a python list or tuple.
 
            If a keyword has the python value ``None`` then it will *not* be
            added to the Gromacs command line; this allows for flexible
@@ -504,6 +686,24 @@ class GromacsCommand(Command):
         self.gmxargs = self._combineargs(*args, **kwargs)
         self._doc_cache = None
 
+    def __getstate__(self):
+        """Return the state for pickling; caches and derived attributes are left out."""
+        state = super(GromacsCommand, self).__getstate__()
+        for name in ('_doc_cache', '_on_failure'):
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        # also accepts the __dict__ of commands pickled before __slots__ were
+        # used: the failure handler is derived from the mode and caches start empty
+        state = dict(state)
+        failuremode = state.pop('_GromacsCommand__failuremode', 'raise')
+        for name in ('_doc_cache', '_on_failure', '_argv_cache'):
+            state.pop(name, None)
+        super(GromacsCommand, self).__setstate__(state)
+        self.failuremode = failuremode
+        self._doc_cache = None
+
     def failuremode():
         doc = """mode determines how the GromacsCommand behaves during failure
 
@@ -523,9 +723,15 @@ class GromacsCommand(Command):
             if not mode in self.failuremodes:
                 raise ValueError('failuremode must be one of {0!r}'.format(self.failuremodes))
             self.__failuremode = mode
+            self._on_failure = _FAILURE_HANDLERS[mode]
         return locals()
     failuremode = property(**failuremode())
 
+    @property
+    def gmxdoc(self):
+        """Usage for the underlying Gromacs tool (extracted on first access)."""
+        return self._get_gmx_docs()
+
     def _combine_arglist(self, args, kwargs):
         """Combine the default values and the supplied values."""
         gmxargs = self.gmxargs.copy()
@@ -534,26 +740,19 @@ class GromacsCommand(Command):
 
     def check_failure(self, result, msg='Gromacs tool failed', command_string=None):
         rc, out, err = result
+        if rc == 0:
+            return True
         if command_string is not None:
             msg += '\nCommand invocation: ' + str(command_string)
-        had_success = (rc == 0)
-        if not had_success:
-            gmxoutput = "\n".join([x for x in [out, err] if x is not None])
-            m = re.search(self.gmxfatal_pattern, gmxoutput, re.VERBOSE | re.DOTALL)
-            if m:
-                formatted_message = ['GMX_FATAL  '+line for line in m.group('message').split('\n')]
-                msg = "\n".join(\
-                    [msg, "Gromacs command {program_name!r} fatal error message:".format(**m.groupdict())] +
-                    formatted_message)
-            if self.failuremode == 'raise':
-                raise GromacsError(rc, msg)
-            elif self.failuremode == 'warn':
-                warnings.warn(msg + '\nError code: {0!r}\n'.format(rc), category=GromacsFailureWarning)
-            elif self.failuremode is None:
-                pass
-            else:
-                raise ValueError('unknown failure mode {0!r}'.format(self.failuremode))
-        return had_success
+        gmxoutput = "\n".join([x for x in [out, err] if x is not None])
+        m = re.search(self.gmxfatal_pattern, gmxoutput, re.VERBOSE | re.DOTALL)
+        if m:
+            formatted_message = ['GMX_FATAL  '+line for line in m.group('message').split('\n')]
+            msg = "\n".join(\
+                [msg, "Gromacs command {program_name!r} fatal error message:".format(**m.groupdict())] +
+                formatted_message)
+        self._on_failure(rc, msg)           # handler is chosen when failuremode is set
+        return False
 
     def _combineargs(self, *args, **kwargs):
         """Add switches as 'options' with value True to the options dict."""
@@ -561,32 +760,44 @@ class GromacsCommand(Command):
         d.update(kwargs)
         return d
 
+    def _translate_flag(self, flag):
+        """Return the gromacs flag for the keyword *flag* and its negation.
+
+        The (interned) results are kept in :attr:`_flag_cache`, which is
+        shared by all commands.
+        """
+        name = str(flag)
+        if name.startswith('_'):
+            name = name[1:]                     # python-illegal keywords are '_'-quoted
+        if not name.startswith('-'):
+            name = '-' + name                   # now flag is guaranteed to start with '-'
+        if name.startswith('-no'):
+            # negate a negated flag ('noX=False' --> X=True --> -X ... but who uses that?)
+            negated = '-' + name[3:]
+        else:
+            negated = '-no' + name[1:]          # gromacs switches booleans by prefixing 'no'
+        flags = self._flag_cache[flag] = (intern(name), intern(negated))
+        return flags
+
     def _build_arg_list(self, **kwargs):
         """Build list of arguments from the dict; keys must be valid  gromacs flags."""
         arglist = []
+        flag_cache = self._flag_cache
         for flag, value in kwargs.items():
             # XXX: check flag against allowed values
-            flag = str(flag)
-            if flag.startswith('_'):
-                flag = flag[1:]                 # python-illegal keywords are '_'-quoted
-            if not flag.startswith('-'):
-                flag = '-' + flag               # now flag is guaranteed to start with '-'
+            flag, negated = flag_cache.get(flag) or self._translate_flag(flag)
             if value is True:
                 arglist.append(flag)            # simple command line flag
             elif value is False:
-                if flag.startswith('-no'):
-                    # negate a negated flag ('noX=False' --> X=True --> -X ... but who uses that?)
-                    arglist.append('-' + flag[3:])
-                else:
-                    arglist.append('-no' + flag[1:])  # gromacs switches booleans by prefixing 'no'
+                arglist.append(negated)
             elif value is None:
                 pass                            # ignore flag = None
+            elif isinstance(value, (list, tuple)):
+                arglist.append(flag)            # option with value list
+                arglist.extend([str(v) for v in value])
             else:
-                try:
-                    arglist.extend([flag] + value) # option with value list
-                except TypeError:
-                    arglist.extend([flag, value])  # option with single value
-        return map(str, arglist)  # all arguments MUST be strings
+                arglist.extend((flag, str(value)))  # option with single value
+        return arglist                          # all arguments are strings
 
     def _run_command(self,*args,**kwargs):
         """Execute the gromacs command; see the docs for __call__."""
@@ -594,6 +805,53 @@ class GromacsCommand(Command):
         self.check_failure(result, command_string=p.command_string)
         return result, p
 
+    def _run_command_streaming(self, *args, **kwargs):
+        """Execute the gromacs command and read its output in chunks.
+
+        Meant for probing the tool (e.g. with ``'-h'``): *args* are appended
+        verbatim to the command, so neither the instance defaults nor input
+        or keyword processing of :meth:`Popen` are involved and nothing is
+        logged. Stdin is closed immediately and stdout and stderr are drained
+        with :func:`os.read` in blocks of *chunksize* bytes (default 64 KiB)
+        instead of :meth:`PopenWithInput.communicate`; reads interrupted by a
+        signal are retried and the child is killed if reading fails. The
+        output is not decoded and the return code is not checked.
+
+        :Returns: the *results* tuple ``(rc, stdout, stderr)`` with the output
+                  as :class:`bytearray`
+        """
+        chunksize = kwargs.pop('chunksize', 65536)
+        argv = [self.command_name] + list(args)
+        if self.driver is not None:
+            argv.insert(0, self.driver)
+        p = PopenWithInput(argv, stdin=PIPE, stdout=PIPE, stderr=PIPE,
+                           executable=_find_executable(argv[0]))
+        p.stdin.close()
+        out, err = bytearray(), bytearray()
+        output = {p.stdout.fileno(): out, p.stderr.fileno(): err}
+        fds = list(output)
+        try:
+            while fds:
+                ready, _, _ = _retry_on_eintr(select.select, fds, [], [])
+                for fd in ready:
+                    chunk = _retry_on_eintr(os.read, fd, chunksize)
+                    if chunk:
+                        output[fd] += chunk
+                    else:
+                        fds.remove(fd)          # EOF
+        except:
+            # do not leave the child running (or a zombie) behind
+            try:
+                p.kill()
+            except OSError:
+                pass                            # already reaped
+            p.wait()
+            raise
+        finally:
+            p.stdout.close()
+            p.stderr.close()
+        return p.wait(), out, err
+
     def _commandline(self, *args, **kwargs):
         """Returns the command line (without pipes) as a list. Inserts driver if present"""
         if(self.driver is not None):
@@ -606,37 +864,71 @@ class GromacsCommand(Command):
         newargs = self._combineargs(*args, **kwargs)
         return self._build_arg_list(**newargs)
 
+    def _doc_cache_key(self):
+        """Key of the tool in the documentation cache.
+
+        The key contains the path and the modification time of the executable
+        so that the cached doc string is discarded when Gromacs is
+        upgraded. ``None`` is returned if the executable cannot be found.
+        """
+        name = self.driver or self.command_name
+        if os.path.dirname(name):
+            exe = utilities.which(name)         # path: does not search PATH
+        else:
+            exe = _find_executable(name)
+        if exe is None:
+            return None
+        return (self.driver, self.command_name, exe, os.stat(exe).st_mtime)
+
     def _get_gmx_docs(self):
         """Extract standard gromacs doc
 
         Extract by running the program and chopping the header to keep from
-        'DESCRIPTION' onwards.
+        'DESCRIPTION' onwards. The result is stored in the documentation cache
+        so that the program only has to be run once per installed version.
         """
-        if self._doc_cache is not None:
-            return self._doc_cache
+        global _DOC_CACHE_MODIFIED
+        # getattr: the slot is unset if a subclass did not call our __init__
+        docs = getattr(self, '_doc_cache', None)
+        if docs is not None:
+            return docs
 
         try:
-            logging.disable(logging.CRITICAL)
-            rc, header, docs = self.run('h', stdout=PIPE, stderr=PIPE, use_input=False)
+            key = self._doc_cache_key()
+        except Exception:
+            key = None                          # e.g. stat() failed: do not cache
+        if key is not None:
+            docs = _get_doc_cache().get(key)
+            if docs is not None:
+                self._doc_cache = docs
+                return self._doc_cache
+
+        try:
+            rc, header, docs = self._run_command_streaming('-h')
         except:
-            logging.critical("Invoking command {0} failed when determining its doc string. Proceed with caution".format(self.command_name))
+            logger.debug("Invoking command {0} failed when determining its doc string. Proceed with caution".format(self.command_name))
             self._doc_cache = "(No Gromacs documentation available)"
             return self._doc_cache
-        finally:
-            # ALWAYS restore logging...
-            logging.disable(logging.NOTSET)
 
         # The header is on STDOUT and is ignored. The docs are read from STDERR in GMX 4.
-        m = re.match(self.doc_pattern, docs, re.DOTALL)
+        start = docs.find(b'DESCRIPTION')
 
-        if m is None:
+        if start < 0:
             # In GMX 5, the opposite is true (Grrr)
-            m = re.match(self.doc_pattern, header, re.DOTALL)
-            if m is None:
+            docs = header
+            start = docs.find(b'DESCRIPTION')
+            if start < 0:
                 self._doc_cache = "(No Gromacs documentation available)"
                 return self._doc_cache
 
-        self._doc_cache = m.group('DOCS')
+        # only the docs themselves are converted to a (native) string
+        docs = bytes(docs[start:])
+        if not six.PY2:
+            docs = docs.decode('utf-8', 'replace')
+        self._doc_cache = docs
+        if key is not None:
+            _get_doc_cache()[key] = self._doc_cache
+            _DOC_CACHE_MODIFIED = True
         return self._doc_cache
 
 
@@ -668,7 +960,12 @@ class PopenWithInput(subprocess.Popen):
                string that is piped into the command
 
         """
-        kwargs.setdefault('close_fds', True)   # fixes 'Too many open fds' with 2.6
+        # Closing fds fixes 'Too many open fds' with 2.6. Python 3 creates
+        # non-inheritable fds anyway (PEP 446); not closing them lets
+        # subprocess launch with posix_spawn()/vfork() instead of fork(),
+        # which is much cheaper in a large process.
+        kwargs.setdefault('close_fds', sys.version_info[0] < 3)
+        kwargs.setdefault('bufsize', -1)       # Python 2 defaults to unbuffered pipes
         self.input = kwargs.pop('input', None)
         self.command = args[0]
         try:
@@ -688,3 +985,39 @@ class PopenWithInput(subprocess.Popen):
 
     def __str__(self):
         return "<Popen on {0!r}>".format(self.command_string)
+
+
+def gather_commands(commands, max_parallel=None):
+    """Run independent commands concurrently and collect their results.
+
+    Each command is called without arguments in a pool of threads; use
+    :func:`functools.partial` to supply the arguments. The threads only wait
+    for the child processes, so up to *max_parallel* Gromacs tools run at the
+    same time.
+
+    :Arguments:
+      *commands*
+         sequence of callables, typically :class:`GromacsCommand` instances
+         wrapped with :func:`functools.partial`
+      *max_parallel*
+         maximum number of commands running at the same time; by default
+         the number of CPUs
+
+    :Returns: list of the results of the commands (typically the
+              ``(rc, stdout, stderr)`` tuples) in the order of *commands*
+
+    .. Note:: Capturing output to a file
+              (``flags['capture_output'] = "file"``) is not thread safe
+              because all commands write to the same file.
+    """
+    commands = list(commands)
+    if not commands:
+        return []
+    if max_parallel is None:
+        max_parallel = multiprocessing.cpu_count()
+    pool = ThreadPool(min(max_parallel, len(commands)))
+    try:
+        return pool.map(lambda command: command(), commands)
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,361 @@
+# GromacsWrapper: test_core.py
+# Copyright (c) 2009 Oliver Beckstein <orbeckst@gmail.com>
+# Released under the GNU Public License 3 (or higher, your choice)
+# See the file COPYING for details.
+
+from __future__ import division, absolute_import, print_function
+
+import errno
+import os
+import select
+import pytest
+from six.moves import cPickle as pickle
+
+import gromacs.core
+import gromacs.tools
+
+
+class Tool(gromacs.core.GromacsCommand):
+    command_name = "tool"
+
+
+@pytest.fixture
+def tool():
+    return Tool('v', f=['md1.xtc', 'md2.xtc'], o='processed.xtc', t=200)
+
+
+@pytest.mark.parametrize('kwargs,argv', [
+    ({'v': True}, ['-v']),
+    ({'v': False}, ['-nov']),
+    ({'nov': False}, ['-v']),
+    ({'v': None}, []),
+    ({'_or': 'mindistres.xvg'}, ['-or', 'mindistres.xvg']),
+    ({'t': 200}, ['-t', '200']),
+    ({'f': ['md1.xtc', 'md2.xtc']}, ['-f', 'md1.xtc', 'md2.xtc']),
+    ({'f': ('md1.xtc', 'md2.xtc')}, ['-f', 'md1.xtc', 'md2.xtc']),
+    ({'b': [0, 1.5]}, ['-b', '0', '1.5']),
+])
+def test_build_arg_list(kwargs, argv):
+    assert Tool()._build_arg_list(**kwargs) == argv
+
+
+def test_flag_cache():
+    argv1 = Tool()._build_arg_list(xvg='none')
+    argv2 = Tool()._build_arg_list(xvg='none')
+    assert argv1 == ['-xvg', 'none']
+    assert argv1[0] is argv2[0]
+
+
+def test_slots():
+    cls = type("Slotted", (gromacs.core.GromacsCommand,),
+               {'command_name': "tool", '__slots__': ()})
+    cmd = cls(failure='warn', o='out.xvg')
+    assert not hasattr(cmd, '__dict__')
+    assert cmd.failuremode == 'warn'
+    assert cmd.gmxargs == {'o': 'out.xvg'}
+
+
+def test_tool_instance_attributes():
+    cmd = gromacs.tools.Grompp()
+    assert hasattr(cmd, '__dict__')
+    cmd.run = lambda *args, **kwargs: (0, "patched", None)  # like mock.patch.object
+    assert cmd() == (0, "patched", None)
+
+
+@pytest.mark.parametrize('protocol', range(pickle.HIGHEST_PROTOCOL + 1))
+def test_pickle(protocol):
+    cmd = gromacs.tools.Grompp(failure='warn', f='md.mdp')
+    cmd.note = "extra attribute"
+    clone = pickle.loads(pickle.dumps(cmd, protocol))
+    assert type(clone) is type(cmd)
+    assert clone.gmxargs == {'f': 'md.mdp'}
+    assert clone.failuremode == 'warn'
+    assert clone.note == "extra attribute"
+    with pytest.warns(gromacs.core.GromacsFailureWarning):
+        assert clone.check_failure((1, "out", "err")) is False
+
+
+@pytest.mark.parametrize('protocol', range(pickle.HIGHEST_PROTOCOL + 1))
+def test_pickle_after_use(protocol):
+    cmd = gromacs.tools.Grompp(f='md.mdp', n=None)
+    argv = cmd.commandline()
+    cmd._doc_cache = "DESCRIPTION\ncached docs\n"
+    clone = pickle.loads(pickle.dumps(cmd, protocol))
+    assert clone.commandline() == argv
+    assert clone._doc_cache is None
+
+
+def test_setstate_without_slots():
+    # state as pickled by versions whose commands still had a plain __dict__
+    cls = gromacs.tools.Grompp
+    cmd = cls.__new__(cls)
+    cmd.__setstate__({'_GromacsCommand__failuremode': 'warn',
+                      'gmxargs': {'f': 'md.mdp'},
+                      '_doc_cache': None})
+    assert cmd.commandline()[-2:] == ['-f', 'md.mdp']
+    assert cmd.failuremode == 'warn'
+    with pytest.warns(gromacs.core.GromacsFailureWarning):
+        assert cmd.check_failure((1, "out", "err")) is False
+
+
+class Documented(Tool):
+    def __init__(self, *args, **kwargs):
+        # does not call GromacsCommand.__init__() so _doc_cache is never set
+        self.probes = 0
+
+    def _run_command_streaming(self, *args, **kwargs):
+        self.probes += 1
+        return 0, bytearray(b"header\nDESCRIPTION\nusage\n"), bytearray()
+
+
+def test_docs_extracted_once():
+    cmd = Documented()
+    assert cmd.gmxdoc == "DESCRIPTION\nusage\n"
+    assert cmd.gmxdoc == "DESCRIPTION\nusage\n"
+    assert cmd.probes == 1
+
+
+def test_prefetch_docs():
+    commands = [Documented() for i in range(5)]
+    loaded = gromacs.tools.prefetch_docs(commands, max_workers=3)
+    assert len(loaded) == len(commands)
+    assert all(a is b for a, b in zip(loaded, commands))
+    for cmd in loaded:
+        assert cmd.probes == 1
+        assert cmd._doc_cache == "DESCRIPTION\nusage\n"
+
+
+def test_prefetch_docs_classes():
+    loaded = gromacs.tools.prefetch_docs([Documented], max_workers=1)
+    assert len(loaded) == 1 and isinstance(loaded[0], Documented)
+    assert loaded[0].probes == 1
+    assert loaded[0]._doc_cache == "DESCRIPTION\nusage\n"
+
+
+class Sh(gromacs.core.GromacsCommand):
+    command_name = "sh"
+
+
+def test_run_command_streaming():
+    rc, out, err = Sh()._run_command_streaming('-c', 'echo out; echo err >&2; exit 3')
+    assert (rc, out, err) == (3, b"out\n", b"err\n")
+
+    # a full stderr pipe must not block the child while stdout is pending
+    rc, out, err = Sh()._run_command_streaming(
+        '-c', 'yes e 2>/dev/null | head -n 50000 >&2; yes 2>/dev/null | head -n 50000',
+        chunksize=4096)
+    assert (rc, out, err) == (0, b"y\n" * 50000, b"e\n" * 50000)
+
+
+def test_run_command_streaming_eintr(monkeypatch):
+    calls = []
+    def interrupted(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise select.error(errno.EINTR, "Interrupted system call")
+        return real_select(*args)
+    real_select = select.select
+    monkeypatch.setattr(select, "select", interrupted)
+    assert Sh()._run_command_streaming('-c', 'echo out') == (0, b"out\n", b"")
+    assert len(calls) > 1
+
+
+def test_run_command_streaming_cleanup(monkeypatch):
+    Popen = gromacs.core.PopenWithInput
+    started = []
+    def init(self, *args, **kwargs):
+        started.append(self)
+        real_init(self, *args, **kwargs)
+    def interrupted(*args):
+        raise KeyboardInterrupt
+    real_init = Popen.__init__
+    monkeypatch.setattr(Popen, "__init__", init)
+    monkeypatch.setattr(select, "select", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        Sh()._run_command_streaming('-c', 'sleep 60')
+    p, = started
+    assert p.returncode is not None             # killed and reaped
+    assert p.stdout.closed and p.stderr.closed
+
+
+def test_docs_without_path(monkeypatch):
+    monkeypatch.delenv('PATH')
+    assert Tool().gmxdoc == "(No Gromacs documentation available)"
+
+
+class Probe(gromacs.core.GromacsCommand):
+    command_name = "gmxprobe"
+
+
+@pytest.fixture
+def doc_cache(tmpdir, monkeypatch):
+    """Empty documentation cache file in *tmpdir* and a ``gmxprobe`` tool on
+    PATH that appends a line to ``calls.log`` in *tmpdir* whenever it runs."""
+    cachefile = tmpdir.join("docs.pickle")
+    monkeypatch.setattr(gromacs.core, "DOC_CACHE_FILENAME", str(cachefile))
+    monkeypatch.setattr(gromacs.core, "_DOC_CACHE", None)
+    monkeypatch.setattr(gromacs.core, "_DOC_CACHE_MODIFIED", False)
+    bindir = tmpdir.mkdir("bin")
+    script = bindir.join("gmxprobe")
+    script.write("#!/bin/sh\necho run >> '{0}'\n"
+                 "echo header\necho DESCRIPTION\necho usage\n".format(tmpdir.join("calls.log")))
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", str(bindir), prepend=os.pathsep)
+    return cachefile
+
+
+def probes(tmpdir):
+    log = tmpdir.join("calls.log")
+    return log.read().count("run") if log.check() else 0
+
+
+def test_doc_cache_hit(doc_cache, tmpdir):
+    assert Probe().gmxdoc == "DESCRIPTION\nusage\n"
+    assert probes(tmpdir) == 1
+    gromacs.core._save_doc_cache()
+    gromacs.core._DOC_CACHE = None              # as in a new session
+    assert Probe().gmxdoc == "DESCRIPTION\nusage\n"
+    assert probes(tmpdir) == 1
+
+
+def test_doc_cache_executable_changed(doc_cache, tmpdir):
+    Probe().gmxdoc
+    exe = str(tmpdir.join("bin").join("gmxprobe"))
+    st = os.stat(exe)
+    os.utime(exe, (st.st_atime, st.st_mtime + 10))
+    assert Probe().gmxdoc == "DESCRIPTION\nusage\n"
+    assert probes(tmpdir) == 2
+
+
+def test_doc_cache_corrupt(doc_cache, tmpdir):
+    doc_cache.write("not a pickle")
+    assert Probe().gmxdoc == "DESCRIPTION\nusage\n"
+    assert probes(tmpdir) == 1
+    gromacs.core._save_doc_cache()
+    with open(str(doc_cache), 'rb') as cache:
+        assert list(pickle.load(cache).values()) == ["DESCRIPTION\nusage\n"]
+
+
+def test_save_doc_cache(doc_cache, tmpdir, monkeypatch):
+    files = ["bin", "calls.log", "docs.pickle"]
+    gromacs.core._save_doc_cache()
+    assert not doc_cache.check()                # unchanged cache is not written
+    Probe().gmxdoc
+    gromacs.core._save_doc_cache()
+    saved = doc_cache.read_binary()
+    assert sorted(p.basename for p in tmpdir.listdir()) == files
+
+    # a failed write leaves the old file alone and no temporary file behind
+    def rename(src, dst):
+        raise OSError("rename failed")
+    monkeypatch.setattr(os, "rename", rename)
+    gromacs.core._get_doc_cache()["other"] = "changed"
+    gromacs.core._save_doc_cache()
+    assert doc_cache.read_binary() == saved
+    assert sorted(p.basename for p in tmpdir.listdir()) == files
+
+
+class TestTransformArgs(object):
+    def test_defaults(self, tool):
+        argv = tool.transform_args(**tool.gmxargs)
+        assert sorted(argv) == sorted(['-v', '-f', 'md1.xtc', 'md2.xtc',
+                                       '-o', 'processed.xtc', '-t', '200'])
+
+    def test_override(self, tool):
+        tool.transform_args(**tool.gmxargs)
+        argv = tool.commandline(t=100)
+        assert argv[0] == "tool"
+        assert '100' in argv and '200' not in argv
+
+    @pytest.mark.parametrize('first,second,argv', [
+        (1, True, ['-x']),
+        (True, 1, ['-x', '1']),
+        (0, False, ['-nox']),
+        (False, 0, ['-x', '0']),
+        ([1], (1,), ['-x', '1']),
+    ])
+    def test_value_types(self, first, second, argv):
+        tool = Tool()
+        tool.transform_args(x=first)
+        assert tool.transform_args(x=second) == argv
+
+    def test_ndarray(self):
+        numpy = pytest.importorskip("numpy")
+        tool = Tool()
+        value = numpy.array([1, 2])
+        argv = tool.transform_args(x=value)
+        assert tool.transform_args(x=value) == argv
+
+    def test_inplace_change(self, tool):
+        tool.transform_args(**tool.gmxargs)
+        tool.gmxargs['f'].append('md3.xtc')
+        assert 'md3.xtc' in tool.transform_args(**tool.gmxargs)
+
+
+class TestCheckFailure(object):
+    def test_success(self):
+        assert Tool().check_failure((0, None, None)) is True
+
+    def test_raise(self):
+        with pytest.raises(gromacs.core.GromacsError):
+            Tool(failure='raise').check_failure((1, "out", "err"))
+
+    def test_warn(self):
+        with pytest.warns(gromacs.core.GromacsFailureWarning):
+            assert Tool(failure='warn').check_failure((1, "out", "err")) is False
+
+    def test_silent(self):
+        assert Tool(failure=None).check_failure((1, "out", "err")) is False
+
+    def test_change_mode(self):
+        tool = Tool(failure='raise')
+        tool.failuremode = None
+        assert tool.check_failure((1, "out", "err")) is False
+
+    def test_invalid_mode(self):
+        with pytest.raises(ValueError):
+            Tool(failure='ignore')
+
+
+def test_gather_commands():
+    results = gromacs.core.gather_commands(
+        [lambda i=i: (0, str(i), None) for i in range(10)], max_parallel=3)
+    assert [out for rc, out, err in results] == [str(i) for i in range(10)]
+
+
+class Cat(gromacs.core.Command):
+    command_name = "cat"
+
+
+@pytest.mark.parametrize('input,output', [
+    ("q", "q\n"),
+    ("q\n", "q\n"),
+    (["keep 1", "q"], "keep 1\nq\n"),
+    (("Protein", 0), "Protein\n0\n"),
+])
+def test_input(input, output):
+    rc, out, err = Cat().run(input=input, stdout=False)
+    assert rc == 0
+    assert out == output
+
+
+def test_find_executable(tmpdir, monkeypatch):
+    path = gromacs.core._find_executable("cat")
+    assert os.path.basename(path) == "cat"
+    assert gromacs.core._find_executable("cat") is path
+    assert gromacs.core._find_executable("no_such_gromacs_tool") is None
+
+    # relative commands are not cached and must follow the working directory
+    for dirname in ("a", "b"):
+        script = tmpdir.mkdir(dirname).join("run.sh")
+        script.write("#!/bin/sh\necho {0}\n".format(dirname))
+        script.chmod(0o755)
+
+    class Run(gromacs.core.Command):
+        command_name = "./run.sh"
+
+    assert gromacs.core._find_executable("./run.sh") is None
+    monkeypatch.chdir(str(tmpdir.join("a")))
+    assert Run().run(stdout=False)[1] == "a\n"
+    monkeypatch.chdir(str(tmpdir.join("b")))
+    assert Run().run(stdout=False)[1] == "b\n"
@@ -57,6 +57,7 @@ Helpers
 .. autofunction:: load_v5_tools
 .. autofunction:: find_executables
 .. autofunction:: make_valid_identifier
+.. autofunction:: prefetch_docs
 .. autoexception:: GromacsToolLoadingError
 
 Gromacs tools
@@ -70,9 +71,10 @@ import tempfile
 import subprocess
 import atexit
 import logging
+from multiprocessing.pool import ThreadPool
 
 from . import config
-from .core import GromacsCommand
+from .core import GromacsCommand, _LazyDoc
 
 logger = logging.getLogger("gromacs.tools")
 
@@ -160,7 +162,7 @@ def tool_factory(clsname, name, driver, base=GromacsCommand):
     clsdict = {
         'command_name': name,
         'driver': driver,
-        '__doc__': property(base._get_gmx_docs)
+        '__doc__': _LazyDoc(base.__doc__)
     }
     return type(clsname, (base,), clsdict)
 
@@ -272,6 +274,37 @@ def load_v4_tools():
     return tools
 
 
+def prefetch_docs(commands=None, max_workers=None):
+    """ Extract the documentation of many Gromacs tools concurrently.
+
+    Documentation is normally extracted lazily, one tool at a time, by running
+    the tool with ``-h``. Because this time is spent waiting for the child
+    processes, the tools are run in a pool of threads so that all docs are
+    available after roughly the time of the slowest tool. The docs are stored
+    in the documentation cache (see :data:`gromacs.core.DOC_CACHE_FILENAME`).
+
+    :param commands: GromacsCommand classes or instances; by default all
+                     classes in the :data:`registry`
+    :param max_workers: number of threads; by default one per command (but
+                        not more than 32)
+    :return: list of the command instances with their docs loaded
+    """
+    if commands is None:
+        commands = set(registry.values())    # aliases share their class
+    commands = [cmd() if isinstance(cmd, type) else cmd for cmd in commands]
+    if not commands:
+        return commands
+    if max_workers is None:
+        max_workers = min(32, len(commands))
+    pool = ThreadPool(max_workers)
+    try:
+        pool.map(lambda cmd: cmd.gmxdoc, commands)
+    finally:
+        pool.close()
+        pool.join()
+    return commands
+
+
 def merge_ndx(*args):
     """ Takes one or more index files and optionally one structure file and
     returns a path for a new merged index file.